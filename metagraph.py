@@ -1,7 +1,44 @@
 # filename: metagraph.py
 
-import networkx as nx
-from typing import Dict, List, Any
+import re
+import ahocorasick
+import numpy as np
+from typing import Collection, Dict, List, Any, Sequence, Tuple
+
+# Separators used to split node names into searchable tokens,
+# e.g. "Order_Details.OrderID" -> ["order", "details", "orderid"].
+_TOKEN_SPLIT_RE = re.compile(r'[._ ]+')
+
+# Incremented on every metagraph build so caches derived from a schema can
+# tell when it has been rebuilt.
+_build_counter = 0
+
+# Values of SchemaMetagraph.node_kind.
+NODE_KIND_TABLE = 0
+NODE_KIND_COLUMN = 1
+NODE_KIND_NAMES = ('table', 'column')
+
+# Values of SchemaMetagraph.edge_type.
+EDGE_CONTAINS = 0
+EDGE_FK = 1
+EDGE_FK_REVERSE = 2
+EDGE_TYPE_NAMES = ('contains', 'fk', 'fk_reverse')
+
+_EMPTY_IDS = np.empty(0, dtype=np.int32)
+
+# Schema names shorter than this are not matched inside keywords; they would
+# hit almost any word (e.g. "id").
+_MIN_CONTAINED_NAME_LEN = 3
+
+# Words of a name, split on separators and camelCase boundaries,
+# e.g. "ShipCity" -> ["Ship", "City"], "CustomerID" -> ["Customer", "ID"].
+_NAME_WORD_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+# Prefix of SQLite's internal tables (sqlite_sequence, sqlite_stat1, ...).
+_INTERNAL_TABLE_PREFIX = 'sqlite_'
+
+# Added to a table's priority so tables always rank above columns.
+_TABLE_PRIORITY_BONUS = 1000
 
 # ==============================================================================
 # Part 1: Schema Representation as a Metagraph
@@ -20,8 +57,26 @@ class SchemaMetagraph:
         Args:
             schema_dict (Dict[str, Any]): A dictionary describing the database schema.
         """
-        self.graph = nx.DiGraph()
         self.schema_dict = schema_dict
+        self._token_index: Dict[str, np.ndarray] = {}
+        self._token_vocab = np.empty(0, dtype=str)
+        self._name_automaton = ahocorasick.Automaton()
+        self.name_to_id: Dict[str, int] = {}
+        self.node_names = np.empty(0, dtype=str)
+        self.node_names_lower = np.empty(0, dtype=str)
+        self.node_kind = np.empty(0, dtype=np.uint8)
+        self.node_table_id = _EMPTY_IDS
+        self.indptr = np.zeros(1, dtype=np.int32)
+        self.indices = _EMPTY_IDS
+        self.edge_type = np.empty(0, dtype=np.uint8)
+        self.node_priority = _EMPTY_IDS
+        self._adj: Dict[str, Tuple[str, ...]] = {}
+        self._table_columns: Dict[str, Dict[str, dict]] = {}
+        self._table_headers: Dict[str, str] = {}
+        self._table_blocks: Dict[str, str] = {}
+        self._column_lines: Dict[str, Dict[str, str]] = {}
+        self._relationships_block = ""
+        self.version = 0
         self._build_metagraph()
 
     def _build_metagraph(self):
@@ -29,48 +84,293 @@ class SchemaMetagraph:
         Constructs the graph from the schema dictionary.
         This is where we define the relationships between tables and columns.
         """
+        global _build_counter
         print("Building schema metagraph...")
 
+        # Start from empty lookups so the graph can be rebuilt in place
+        self.name_to_id = {}
+        self._name_automaton = ahocorasick.Automaton()
+        self._table_columns = {}
+        self._table_headers = {}
+        self._table_blocks = {}
+        self._column_lines = {}
+        self._relationships_block = ""
+
+        # The graph is stored as a struct-of-arrays: node i is described by
+        # node_names[i], node_kind[i] and node_table_id[i], and its out-edges
+        # are indices[indptr[i]:indptr[i + 1]] with types in edge_type (CSR).
+        names: List[str] = []
+        kinds: List[int] = []
+        table_names: List[str] = []
+
+        def add_node(name: str, kind: int, table_name: str):
+            if name not in self.name_to_id:
+                self.name_to_id[name] = len(names)
+                names.append(name)
+                kinds.append(kind)
+                table_names.append(table_name)
+
+        # Edges keyed on (source, target); re-adding an edge updates its type
+        edges: Dict[Tuple[int, int], int] = {}
+
         # Add table nodes to the graph
         for table_name in self.schema_dict['tables']:
-            self.graph.add_node(table_name, type='table')
+            add_node(table_name, NODE_KIND_TABLE, table_name)
 
         # Add column nodes and connect them to their parent table
         for table_name, table_info in self.schema_dict['tables'].items():
             for column_name in table_info['columns']:
                 node_name = f"{table_name}.{column_name}"
-                self.graph.add_node(node_name, type='column', table=table_name)
+                add_node(node_name, NODE_KIND_COLUMN, table_name)
                 # Add a directed edge from the column to the table it belongs to
-                self.graph.add_edge(node_name, table_name, type='contains')
+                edges[self.name_to_id[node_name], self.name_to_id[table_name]] = EDGE_CONTAINS
 
         # Add relationship edges (e.g., foreign keys) between columns in different tables
         for rel in self.schema_dict.get('relationships', []):
-            from_node = f"{rel['from_table']}.{rel['from_col']}"
-            to_node = f"{rel['to_table']}.{rel['to_col']}"
-            if self.graph.has_node(from_node) and self.graph.has_node(to_node):
-                self.graph.add_edge(from_node, to_node, type='fk')
-                self.graph.add_edge(to_node, from_node, type='fk_reverse')
+            from_id = self.name_to_id.get(f"{rel['from_table']}.{rel['from_col']}")
+            to_id = self.name_to_id.get(f"{rel['to_table']}.{rel['to_col']}")
+            if from_id is not None and to_id is not None:
+                edges[from_id, to_id] = EDGE_FK
+                edges[to_id, from_id] = EDGE_FK_REVERSE
+
+        self.node_names = np.array(names, dtype=str)
+        self.node_names_lower = np.char.lower(self.node_names)
+        self.node_kind = np.array(kinds, dtype=np.uint8)
+        self.node_table_id = np.array([self.name_to_id[table_name] for table_name in table_names], dtype=np.int32)
+
+        # Group edges by source node, keeping insertion order within each row
+        rows: List[List[Tuple[int, int]]] = [[] for _ in names]
+        for (source, target), edge_type in edges.items():
+            rows[source].append((target, edge_type))
+        indptr = [0]
+        indices = []
+        edge_types = []
+        for row in rows:
+            for target, edge_type in row:
+                indices.append(target)
+                edge_types.append(edge_type)
+            indptr.append(len(indices))
+        self.indptr = np.array(indptr, dtype=np.int32)
+        self.indices = np.array(indices, dtype=np.int32)
+        self.edge_type = np.array(edge_types, dtype=np.uint8)
+
+        # Ranking used to trim large candidate sets: tables first, by degree,
+        # then columns by how many foreign-key edges they take part in.
+        in_degree = np.bincount(self.indices, minlength=len(names))
+        out_degree = np.diff(self.indptr)
+        sources = np.repeat(np.arange(len(names), dtype=np.int32), out_degree)
+        fk_degree = np.bincount(sources[self.edge_type != EDGE_CONTAINS], minlength=len(names))
+        self.node_priority = np.where(
+            self.node_kind == NODE_KIND_TABLE,
+            in_degree + out_degree + _TABLE_PRIORITY_BONUS,
+            fk_degree,
+        ).astype(np.int32)
+
+        # Neighbor names per node for lookups by name
+        self._adj = {
+            name: tuple(names[target] for target, _ in row)
+            for name, row in zip(names, rows)
+        }
+
+        # Precompute the substring matches of every name token, so a keyword
+        # that is a token is a hash probe instead of a scan over every node.
+        # Each entry holds all nodes whose name contains the token, not only
+        # the nodes the token came from (e.g. "order" -> Orders.* as well).
+        # One automaton pass over each name finds every token it contains.
+        lower_names = self.node_names_lower.tolist()
+        vocab = sorted({
+            token
+            for node_lower in lower_names
+            for token in _TOKEN_SPLIT_RE.split(node_lower)
+            if token
+        })
+        token_ids: Dict[str, List[int]] = {token: [] for token in vocab}
+        if vocab:
+            token_automaton = ahocorasick.Automaton()
+            for token in vocab:
+                token_automaton.add_word(token, token)
+            token_automaton.make_automaton()
+            for node_id, node_lower in enumerate(lower_names):
+                for token in {token for _, token in token_automaton.iter(node_lower)}:
+                    token_ids[token].append(node_id)
+        self._token_index = {
+            token: np.array(ids, dtype=np.int32)
+            for token, ids in token_ids.items()
+        }
+        self._token_vocab = np.array(vocab, dtype=str)
+
+        # Aho-Corasick automaton over table names and compound column names
+        # with separators removed, so a keyword such as "orderdetails" can be
+        # matched against every schema name it contains in a single pass.
+        # Single-word column names ("name", "city") would match inside
+        # unrelated words ("capacity"), and SQLite's internal tables are never
+        # what a user asks about, so neither is added.
+        compact_ids: Dict[str, List[int]] = {}
+        for node_id, (name, kind) in enumerate(zip(names, kinds)):
+            if table_names[node_id].startswith(_INTERNAL_TABLE_PREFIX):
+                continue
+            short_name = name.rsplit('.', 1)[-1] if kind == NODE_KIND_COLUMN else name
+            if kind == NODE_KIND_COLUMN and len(_NAME_WORD_RE.findall(short_name)) < 2:
+                continue
+            compact_name = _TOKEN_SPLIT_RE.sub('', short_name.lower())
+            if len(compact_name) >= _MIN_CONTAINED_NAME_LEN:
+                compact_ids.setdefault(compact_name, []).append(node_id)
+        for compact_name, ids in compact_ids.items():
+            self._name_automaton.add_word(compact_name, ids)
+        if compact_ids:
+            self._name_automaton.make_automaton()
+
+        # Column metadata per table. Schemas may list columns by name only,
+        # in which case each column gets an empty info dict.
+        for table_name, table_info in self.schema_dict['tables'].items():
+            columns = table_info['columns']
+            if isinstance(columns, dict):
+                self._table_columns[table_name] = dict(columns)
+            else:
+                self._table_columns[table_name] = {column_name: {} for column_name in columns}
+
+        self._render_schema_blocks()
+
+        _build_counter += 1
+        self.version = _build_counter
 
         print("Metagraph built successfully.")
 
-    def get_related_nodes(self, node: str) -> List[str]:
+    def _render_schema_blocks(self):
+        """
+        Pre-renders the text used to describe the schema to the LLM: a header
+        and full block per table, one line per column (by table, then column
+        name), and the relationships.
+        """
+        for table_name, columns in self._table_columns.items():
+            table_info = self.schema_dict['tables'][table_name]
+            header = f"Table: {table_name}\n"
+            if 'description' in table_info:
+                header += f"Description: {table_info['description']}\n"
+            header += "Columns:\n"
+            self._table_headers[table_name] = header
+
+            lines = {}
+            for column_name, column_info in columns.items():
+                line = f"  - {column_name}"
+                if column_info.get('type'):
+                    line += f" ({column_info['type']})"
+                if column_info.get('description'):
+                    line += f": {column_info['description']}"
+                lines[column_name] = line + "\n"
+            self._column_lines[table_name] = lines
+            self._table_blocks[table_name] = header + "".join(lines.values()) + "\n"
+
+        relationships = self.schema_dict.get('relationships', [])
+        if relationships:
+            lines = [
+                f"  - {rel['from_table']}.{rel['from_col']} connects to {rel['to_table']}.{rel['to_col']}\n"
+                for rel in relationships
+            ]
+            self._relationships_block = "Relationships:\n" + "".join(lines) + "\n"
+
+    def render_context(self, tables: Collection[str], columns_by_table: Dict[str, Collection[str]]) -> str:
+        """
+        Renders the schema description sent to the LLM from the pre-rendered
+        blocks. Tables in `tables` are described in full; tables that only
+        appear in `columns_by_table` list just those columns. Tables are
+        sorted by name, unknown names are skipped, and the relationships
+        block comes last.
+        """
+        parts = []
+        for table_name in sorted(set(tables).union(columns_by_table)):
+            # Check if the table exists in the schema
+            if table_name not in self._table_blocks:
+                continue
+            if table_name in tables:
+                parts.append(self._table_blocks[table_name])
+            else:
+                # Only describe the requested columns, in schema order
+                table_columns = columns_by_table[table_name]
+                parts.append(self._table_headers[table_name])
+                for col_name, line in self._column_lines[table_name].items():
+                    if col_name in table_columns:
+                        parts.append(line)
+                parts.append("\n")
+
+        # Add relationships for a more complete context
+        parts.append(self._relationships_block)
+
+        return "".join(parts)
+
+    def find_node_ids_many(self, keywords: Sequence[str]) -> np.ndarray:
         """
-        Returns a list of nodes directly connected to a given node.
+        Returns the sorted ids of the nodes matching any of the lowercased
+        keywords. A node matches if a keyword is a substring of its name, or
+        if its name, without separators, occurs inside a keyword (Aho-Corasick
+        automaton). Substring hits for keywords that are name tokens come from
+        the precomputed index; the rest share one vectorized search over all
+        names and keywords.
+        """
+        if not keywords:
+            return _EMPTY_IDS
+        keyword_array = np.array(keywords, dtype=str)
+        is_token = np.isin(keyword_array, self._token_vocab)
+        parts = [self._token_index[keyword] for keyword in keyword_array[is_token].tolist()]
+
+        other_keywords = keyword_array[~is_token]
+        if len(other_keywords):
+            # Keywords x nodes substring matrix, reduced to "any keyword matches"
+            substring_mask = (np.char.find(self.node_names_lower[np.newaxis, :], other_keywords[:, np.newaxis]) >= 0).any(axis=0)
+            parts.append(np.flatnonzero(substring_mask).astype(np.int32))
+
+        if self._name_automaton.kind == ahocorasick.AHOCORASICK:
+            contained_ids = []
+            for keyword in keyword_array.tolist():
+                for _, ids in self._name_automaton.iter(keyword):
+                    contained_ids.extend(ids)
+            parts.append(np.array(contained_ids, dtype=np.int32))
+
+        if not parts:
+            return _EMPTY_IDS
+        return np.unique(np.concatenate(parts)).astype(np.int32)
+
+    def neighbors_of_many(self, node_ids: np.ndarray) -> np.ndarray:
+        """
+        Returns the ids of the nodes directly connected to any of the given
+        node ids, gathered from the CSR arrays in one vectorized pass.
+        """
+        starts = self.indptr[node_ids]
+        lengths = self.indptr[node_ids + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return _EMPTY_IDS
+        # Position of each gathered edge: its row's start plus its offset in the row
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        return self.indices[offsets]
+
+    def get_related_nodes(self, node: str) -> Sequence[str]:
+        """
+        Returns the nodes directly connected to a given node.
         This will be useful later for providing context to the LLM.
         """
-        return list(self.graph.neighbors(node))
+        return self._adj.get(node, ())
 
     def get_graph_data_for_json(self) -> Dict[str, List[Dict[str, str]]]:
         """
         Exports the graph data in a JSON-friendly format for visualization.
         Returns a dictionary with 'nodes' and 'links' lists.
         """
+        names = self.node_names.tolist()
+        kinds = self.node_kind.tolist()
+        table_ids = self.node_table_id.tolist()
+
         nodes = []
-        for node, data in self.graph.nodes(data=True):
-            nodes.append({"id": node, "type": data.get("type"), "table": data.get("table")})
+        for name, kind, table_id in zip(names, kinds, table_ids):
+            table = names[table_id] if kind == NODE_KIND_COLUMN else None
+            nodes.append({"id": name, "type": NODE_KIND_NAMES[kind], "table": table})
 
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        edge_types = self.edge_type.tolist()
         links = []
-        for u, v, data in self.graph.edges(data=True):
-            links.append({"source": u, "target": v, "type": data.get("type")})
+        for source, name in enumerate(names):
+            for k in range(indptr[source], indptr[source + 1]):
+                links.append({"source": name, "target": names[indices[k]], "type": EDGE_TYPE_NAMES[edge_types[k]]})
         
         return {"nodes": nodes, "links": links}